@@ -1,63 +1,92 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import re
+import threading
 from dataclasses import dataclass
-from typing import Dict, Any, Iterable, Optional
+from typing import Dict, Any, Iterable, List, Optional
 
 import numpy as np
 import torch
-import tensorflow as tf
-from transformers import AutoModelForSequenceClassification, AutoTokenizer, TextClassificationPipeline
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from telemetry import get_logger, redact, span, timed_load
+
+log = get_logger("analyzer")
 
 MODEL_TOXIC = "unitary/toxic-bert"
 MODEL_EMOTION = "bhadresh-savani/bert-base-uncased-emotion"
 MODEL_EMPATHY = "paragon-analytics/bert_empathy"
 MODEL_POLITENESS = "Genius1237/xlm-roberta-large-tydip"
 
+# texts per forward pass in the batch APIs
+BATCH_SIZE = 32
+
 
 _vader_analyzer = None
-_pipe_toxic = None
-_pipe_emotion = None
+_toxic_tokenizer = None
+_toxic_model = None
+_emotion_tokenizer = None
+_emotion_model = None
 _empathy_tokenizer = None
 _empathy_model = None
 _politeness_tokenizer = None
 _politeness_model = None
+_tokenizer_groups = None
+
+# requests run in worker threads; two concurrent from_pretrained calls for the same model
+# leave it with meta tensors, so each loader initializes under its own lock
+_load_locks = {key: threading.Lock() for key in ("vader", "toxic", "emotion", "empathy", "politeness")}
 
 
 def _vader():
     global _vader_analyzer
     if _vader_analyzer is None:
-        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-        _vader_analyzer = SentimentIntensityAnalyzer()
+        with _load_locks["vader"]:
+            if _vader_analyzer is None:
+                from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+                _vader_analyzer = SentimentIntensityAnalyzer()
     return _vader_analyzer
 
 
 def _toxic():
-    global _pipe_toxic
-    if _pipe_toxic is None:
-        tok = AutoTokenizer.from_pretrained(MODEL_TOXIC)
-        mdl = AutoModelForSequenceClassification.from_pretrained(MODEL_TOXIC)
-        _pipe_toxic = TextClassificationPipeline(model=mdl, tokenizer=tok, return_all_scores=True, top_k=None)
-    return _pipe_toxic
+    """Load toxicity model"""
+    global _toxic_tokenizer, _toxic_model
+    if _toxic_tokenizer is None or _toxic_model is None:
+        with _load_locks["toxic"]:
+            # another request may have loaded it while we waited
+            if _toxic_tokenizer is None or _toxic_model is None:
+                with timed_load("toxic"):
+                    _toxic_tokenizer = AutoTokenizer.from_pretrained(MODEL_TOXIC)
+                    _toxic_model = AutoModelForSequenceClassification.from_pretrained(MODEL_TOXIC).eval()
+    return _toxic_tokenizer, _toxic_model
 
 
 def _emotion():
-    global _pipe_emotion
-    if _pipe_emotion is None:
-        tok = AutoTokenizer.from_pretrained(MODEL_EMOTION)
-        mdl = AutoModelForSequenceClassification.from_pretrained(MODEL_EMOTION)
-        _pipe_emotion = TextClassificationPipeline(model=mdl, tokenizer=tok, return_all_scores=True, top_k=None)
-    return _pipe_emotion
+    """Load emotion model"""
+    global _emotion_tokenizer, _emotion_model
+    if _emotion_tokenizer is None or _emotion_model is None:
+        with _load_locks["emotion"]:
+            # another request may have loaded it while we waited
+            if _emotion_tokenizer is None or _emotion_model is None:
+                with timed_load("emotion"):
+                    _emotion_tokenizer = AutoTokenizer.from_pretrained(MODEL_EMOTION)
+                    _emotion_model = AutoModelForSequenceClassification.from_pretrained(MODEL_EMOTION).eval()
+    return _emotion_tokenizer, _emotion_model
 
 
 def _empathy():
     """Load empathy model"""
     global _empathy_tokenizer, _empathy_model
     if _empathy_tokenizer is None or _empathy_model is None:
-        _empathy_tokenizer = AutoTokenizer.from_pretrained(MODEL_EMPATHY)
-        _empathy_model = AutoModelForSequenceClassification.from_pretrained(MODEL_EMPATHY)
+        with _load_locks["empathy"]:
+            # another request may have loaded it while we waited
+            if _empathy_tokenizer is None or _empathy_model is None:
+                with timed_load("empathy"):
+                    _empathy_tokenizer = AutoTokenizer.from_pretrained(MODEL_EMPATHY)
+                    _empathy_model = AutoModelForSequenceClassification.from_pretrained(MODEL_EMPATHY).eval()
     return _empathy_tokenizer, _empathy_model
 
 
@@ -65,11 +94,90 @@ def _politeness():
     """Load politeness model"""
     global _politeness_tokenizer, _politeness_model
     if _politeness_tokenizer is None or _politeness_model is None:
-        _politeness_tokenizer = AutoTokenizer.from_pretrained(MODEL_POLITENESS)
-        _politeness_model = AutoModelForSequenceClassification.from_pretrained(MODEL_POLITENESS)
+        with _load_locks["politeness"]:
+            # another request may have loaded it while we waited
+            if _politeness_tokenizer is None or _politeness_model is None:
+                with timed_load("politeness"):
+                    _politeness_tokenizer = AutoTokenizer.from_pretrained(MODEL_POLITENESS)
+                    _politeness_model = AutoModelForSequenceClassification.from_pretrained(MODEL_POLITENESS).eval()
     return _politeness_tokenizer, _politeness_model
 
 
+_LOADERS = {
+    "toxic": _toxic,
+    "emotion": _emotion,
+    "empathy": _empathy,
+    "politeness": _politeness,
+}
+
+
+def _tokenizer_signature(tok) -> str:
+    """Hash of everything that affects a tokenizer's output (vocab, normalizer, special tokens, ...)"""
+    if getattr(tok, "is_fast", False):
+        # the serialized backend covers vocab, normalizer, pre-tokenizer and post-processor;
+        # truncation/padding are runtime state set by the last call, not part of the tokenizer
+        backend = json.loads(tok.backend_tokenizer.to_str())
+        backend.pop("truncation", None)
+        backend.pop("padding", None)
+        config = json.dumps(backend, sort_keys=True)
+    else:
+        config = json.dumps([sorted(tok.get_vocab().items()), tok.init_kwargs], sort_keys=True, default=str)
+    config += json.dumps([tok.special_tokens_map, tok.model_input_names, tok.padding_side, tok.model_max_length], default=str)
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+
+def tokenizer_groups() -> Dict[str, List[str]]:
+    """
+    Group the classifiers whose tokenizers are identical, e.g. toxic-bert, the emotion model
+    and bert_empathy are all bert-base-uncased derivatives. Each group is tokenized once.
+    """
+    global _tokenizer_groups
+    if _tokenizer_groups is None:
+        groups: Dict[str, List[str]] = {}
+        for key, load in _LOADERS.items():
+            tok, _ = load()
+            groups.setdefault(_tokenizer_signature(tok), []).append(key)
+        _tokenizer_groups = groups
+        log.info("tokenizer groups", extra={"groups": list(groups.values())})
+    return _tokenizer_groups
+
+
+def encode(texts: List[str], keys: Iterable[str] = tuple(_LOADERS)) -> Dict[str, Any]:
+    """Tokenize `texts` once per tokenizer group; returns model key -> padded tensors"""
+    keys = set(keys)
+    encoded = {}
+    for group in tokenizer_groups().values():
+        members = [k for k in group if k in keys]
+        if not members:
+            continue
+        tok, _ = _LOADERS[members[0]]()
+        with span("tokenize", model="+".join(members)):
+            batch = tok(texts, padding=True, truncation=True, return_tensors="pt")
+        for key in members:
+            encoded[key] = batch
+    return encoded
+
+
+def _logits(key: str, encoded) -> torch.Tensor:
+    _, model = _LOADERS[key]()
+    with torch.no_grad(), span("forward", model=key):
+        return model(**encoded).logits
+
+
+def _class_probs(key: str, logits: torch.Tensor) -> torch.Tensor:
+    """Same activation TextClassificationPipeline would apply for this model"""
+    _, model = _LOADERS[key]()
+    if model.config.problem_type == "multi_label_classification" or model.config.num_labels == 1:
+        return torch.sigmoid(logits)
+    return torch.softmax(logits, dim=-1)
+
+
+def _own_encoding(key: str, text: str):
+    tok, _ = _LOADERS[key]()
+    with span("tokenize", model=key):
+        return tok([text], padding=True, truncation=True, return_tensors="pt")
+
+
 LIWC_LEX = {
     "social": {
         "we", "us", "our", "friend", "friends", "together", "team", "community", "talk", "share", "support"
@@ -80,56 +188,73 @@ LIWC_LEX = {
 }
 
 
-def score_toxicity(text: str) -> float:
+def _toxicity_scores(encoded) -> List[float]:
+    _, model = _toxic()
+    probs = _class_probs("toxic", _logits("toxic", encoded))
+    labels = [model.config.id2label[i].lower() for i in range(probs.shape[-1])]
+    toxic_like = [i for i, label in enumerate(labels) if "toxic" in label]
+    out = []
+    for row in probs:
+        score = row[toxic_like].mean() if toxic_like else row.max()
+        out.append(float(np.clip(score.item(), 0.0, 1.0)))
+    return out
+
+
+def score_toxicity(text: str, encoded=None) -> float:
     """Score text for toxicity using unitary/toxic-bert"""
-    pipe = _toxic()
-    scores = pipe(text)[0]
-    toxic_like = [s["score"] for s in scores if "toxic" in s["label"].lower()]
-    if toxic_like:
-        return float(np.clip(np.mean(toxic_like), 0.0, 1.0))
-    return float(np.clip(max(s["score"] for s in scores), 0.0, 1.0))
+    if encoded is None:
+        encoded = _own_encoding("toxic", text)
+    return _toxicity_scores(encoded)[0]
+
 
+def _empathy_scores(encoded) -> List[float]:
+    probs = torch.softmax(_logits("empathy", encoded), dim=-1)
+    return [float(p) for p in probs[:, 0]]
 
-def score_empathy(text: str) -> float:
+
+def score_empathy(text: str, encoded=None) -> float:
     """Score text for empathy using paragon-analytics/bert_empathy"""
-    tokenizer, model = _empathy()
-    encoded_input = tokenizer(text, return_tensors='pt')
-    output = model(**encoded_input)
-    scores = output[0][0].detach().numpy()
-    scores = tf.nn.softmax(scores)
-    
-    print(f"Text: {text}\n")
-    print(f"Empathy probabilities: {scores.numpy()}\n")
-    return scores.numpy()[0]
+    if encoded is None:
+        encoded = _own_encoding("empathy", text)
+    score = _empathy_scores(encoded)[0]
+    log.debug("empathy probability", extra={"user_input": redact(text), "score": score})
+    return score
 
 
-def score_politeness(text: str) -> float:
-    """Score text for politeness using Genius1237/xlm-roberta-large-tydip"""
-    tokenizer, model = _politeness()
-    encoded_input = tokenizer(text, return_tensors='pt')
-    output = model(**encoded_input)
-    
-    logits = output.logits[0]
-    probs = torch.nn.functional.softmax(logits, dim=0)
-    
+def _politeness_scores(encoded) -> List[float]:
+    _, model = _politeness()
+    logits = _logits("politeness", encoded)
+    probs = torch.softmax(logits, dim=-1)
+
     # Find the "polite" class index
     for idx, label in model.config.id2label.items():
         if label.lower() == 'polite':
-            return float(probs[idx].item())
-    
+            return [float(p) for p in probs[:, idx]]
+
     # Fallback
-    prediction = torch.argmax(output.logits).item()
-    predicted_label = model.config.id2label[prediction]
-    if predicted_label.lower() == 'polite':
-        return float(probs[prediction].item())
-    else:
-        return float(1.0 - probs[prediction].item())
+    out = []
+    for row in probs:
+        prediction = int(torch.argmax(row).item())
+        predicted_label = model.config.id2label[prediction]
+        if predicted_label.lower() == 'polite':
+            out.append(float(row[prediction].item()))
+        else:
+            out.append(float(1.0 - row[prediction].item()))
+    return out
+
+
+def score_politeness(text: str, encoded=None) -> float:
+    """Score text for politeness using Genius1237/xlm-roberta-large-tydip"""
+    if encoded is None:
+        encoded = _own_encoding("politeness", text)
+    return _politeness_scores(encoded)[0]
 
 
 def score_sentiment(text: str) -> Dict[str, float]:
     """Score sentiment using VADER"""
     v = _vader()
-    s = v.polarity_scores(text)
+    with span("forward", model="vader"):
+        s = v.polarity_scores(text)
     return {
         "pos": float(s.get("pos", 0.0)),
         "neu": float(s.get("neu", 0.0)),
@@ -138,12 +263,21 @@ def score_sentiment(text: str) -> Dict[str, float]:
     }
 
 
-def score_emotions(text: str) -> Dict[str, float]:
+def _emotion_scores(encoded) -> List[Dict[str, float]]:
+    _, model = _emotion()
+    probs = _class_probs("emotion", _logits("emotion", encoded))
+    out = []
+    for row in probs:
+        total = float(row.sum()) or 1.0
+        out.append({model.config.id2label[i].lower(): float(p / total) for i, p in enumerate(row.tolist())})
+    return out
+
+
+def score_emotions(text: str, encoded=None) -> Dict[str, float]:
     """Score emotions using bhadresh-savani/bert-base-uncased-emotion"""
-    pipe = _emotion()
-    raw = pipe(text)[0]
-    total = sum(x["score"] for x in raw) or 1.0
-    return {x["label"].lower(): float(x["score"] / total) for x in raw}
+    if encoded is None:
+        encoded = _own_encoding("emotion", text)
+    return _emotion_scores(encoded)[0]
 
 
 def nrclex_counts(text: str) -> Dict[str, int]:
@@ -399,6 +533,27 @@ def judge_text(metrics: Dict[str, Any],
     )
 
 
+def _model_scores(texts: List[str]) -> List[Dict[str, Any]]:
+    """Classifier scores per text, in length-sorted batches tokenized once per tokenizer group"""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))  # similar lengths -> less padding
+    out: List[Dict[str, Any]] = [{} for _ in texts]
+    for start in range(0, len(order), BATCH_SIZE):
+        idx = order[start:start + BATCH_SIZE]
+        encoded = encode([texts[i] for i in idx])
+        toxicity = _toxicity_scores(encoded["toxic"])
+        empathy = _empathy_scores(encoded["empathy"])
+        politeness = _politeness_scores(encoded["politeness"])
+        emotions = _emotion_scores(encoded["emotion"])
+        for j, i in enumerate(idx):
+            out[i] = {
+                "toxicity": toxicity[j],
+                "empathy": empathy[j],
+                "politeness": politeness[j],
+                "emotions": emotions[j],
+            }
+    return out
+
+
 def analyze_text(text: str) -> Dict[str, Any]:
     """
     Comprehensive text analysis for toxicity, empathy, politeness, and prosocial behavior.
@@ -409,16 +564,24 @@ def analyze_text(text: str) -> Dict[str, Any]:
     Returns:
         Dictionary with all metrics and rewrite recommendations
     """
-    text = (text or "").strip()
-    if not text:
+    return analyze_texts([text])[0]
+
+
+def analyze_texts(texts: List[str]) -> List[Dict[str, Any]]:
+    """Batch version of analyze_text"""
+    texts = [(t or "").strip() for t in texts]
+    if not all(texts):
         raise ValueError("Empty text")
+    return [_metrics(text, scores) for text, scores in zip(texts, _model_scores(texts))]
+
 
+def _metrics(text: str, scores: Dict[str, Any]) -> Dict[str, Any]:
     # Core scoring
-    toxicity = score_toxicity(text)
-    empathy = score_empathy(text)
-    politeness = score_politeness(text)
+    toxicity = scores["toxicity"]
+    empathy = scores["empathy"]
+    politeness = scores["politeness"]
     sentiment = score_sentiment(text)
-    emotions = score_emotions(text)
+    emotions = scores["emotions"]
     nrc = nrclex_counts(text)
     liwc = liwc_like(text)
     
@@ -471,8 +634,15 @@ def analyze_text_simple(text: str) -> Dict[str, Any]:
     """
     Simplified output with just labels
     """
-    result = analyze_text(text)
-    
+    return _simple(analyze_text(text))
+
+
+def analyze_texts_simple(texts: List[str]) -> List[Dict[str, Any]]:
+    """Batch version of analyze_text_simple"""
+    return [_simple(result) for result in analyze_texts(texts)]
+
+
+def _simple(result: Dict[str, Any]) -> Dict[str, Any]:
     return {
         "toxicity": result["toxicity_label"],
         "empathy": result["empathy_label"],
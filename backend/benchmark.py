@@ -0,0 +1,270 @@
+"""
+Benchmark suite for the analyzer and rephrase pipelines.
+
+Measures per-stage latency (p50/p95/p99), throughput, peak RSS and generation
+tokens/sec over a fixed corpus of short, medium and long messages (bench_corpus.jsonl).
+Batch stages compare tokenizing with every classifier's own tokenizer against the
+shared tokenization in analyzer.encode, and time analyze_texts.
+
+Profiles:
+    fast  tiny randomly initialized models (stub_models.py), runs offline in seconds
+    full  the real checkpoints used by analyzer.py / rephrase.py
+
+Examples:
+    python benchmark.py --profile fast
+    python benchmark.py --profile full --output bench_results/full.json
+    python benchmark.py --profile fast --compare bench_results/fast-abc1234.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BASE_DIR, "bench_corpus.jsonl")
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, "bench_results")
+
+# generation budget per profile; the tiny stub model never emits EOS on purpose,
+# so without a cap every fast-profile generation would run the full 512 tokens
+MAX_NEW_TOKENS = {"fast": 64, "full": 512}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def load_corpus(fp: str) -> List[Dict[str, str]]:
+    with open(fp, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(latencies: List[float], total_s: float, items: int) -> Dict[str, float]:
+    """Latency percentiles in ms and items/sec"""
+    arr = np.array(latencies, dtype=float) * 1000.0
+    return {
+        "n": int(arr.size),
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "throughput_per_s": float(items / total_s) if total_s > 0 else 0.0,
+    }
+
+
+def run_stage(
+    name: str,
+    fn: Callable[[str], Any],
+    corpus: List[Dict[str, str]],
+    repeat: int,
+    tokens_of: Optional[Callable[[Any], int]] = None,
+) -> Dict[str, Any]:
+    """Time `fn(text)` over the corpus, `repeat` times, with one warmup call per length bucket"""
+    by_bucket: Dict[str, List[float]] = {}
+    seen = set()
+    for rec in corpus:
+        if rec["length"] not in seen:
+            seen.add(rec["length"])
+            fn(rec["text"])
+
+    latencies: List[float] = []
+    tokens = 0
+    gen_time = 0.0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for rec in corpus:
+            t0 = time.perf_counter()
+            out = fn(rec["text"])
+            dt = time.perf_counter() - t0
+            latencies.append(dt)
+            by_bucket.setdefault(rec["length"], []).append(dt)
+            if tokens_of is not None:
+                tokens += tokens_of(out)
+                gen_time += dt
+    total = time.perf_counter() - start
+
+    result: Dict[str, Any] = summarize(latencies, total, len(latencies))
+    result["by_length"] = {b: summarize(v, sum(v), len(v)) for b, v in by_bucket.items()}
+    if tokens_of is not None:
+        result["generated_tokens"] = tokens
+        result["tokens_per_s"] = float(tokens / gen_time) if gen_time > 0 else 0.0
+    result["peak_rss_mb"] = _peak_rss_mb()
+    print(f"[bench] {name:<22} p50={result['p50_ms']:9.2f}ms  p95={result['p95_ms']:9.2f}ms  "
+          f"p99={result['p99_ms']:9.2f}ms  {result['throughput_per_s']:8.2f}/s")
+    return result
+
+
+def run_batch_stage(name: str, fn: Callable[[List[str]], Any], corpus: List[Dict[str, str]], repeat: int, batch_size: int) -> Dict[str, Any]:
+    """Time `fn(batch)` over the corpus repeated `repeat` times and cut into batches"""
+    texts = [rec["text"] for rec in corpus] * repeat
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    fn(batches[0])  # warmup
+
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for batch in batches:
+        t0 = time.perf_counter()
+        fn(batch)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+
+    result: Dict[str, Any] = summarize(latencies, total, len(texts))
+    result["batch_size"] = batch_size
+    result["peak_rss_mb"] = _peak_rss_mb()
+    print(f"[bench] {name:<22} p50={result['p50_ms']:9.2f}ms  p95={result['p95_ms']:9.2f}ms  "
+          f"p99={result['p99_ms']:9.2f}ms  {result['throughput_per_s']:8.2f} texts/s")
+    return result
+
+
+def build_batch_stages() -> Dict[str, Callable[[List[str]], Any]]:
+    """Batch workloads: tokenizing with each model's own tokenizer vs once per identical-tokenizer group"""
+    import analyzer
+
+    def tokenize_separate(texts):
+        for load in analyzer._LOADERS.values():
+            tok, _ = load()
+            tok(texts, padding=True, truncation=True, return_tensors="pt")
+
+    return {
+        "tokenize_separate": tokenize_separate,
+        "tokenize_shared": analyzer.encode,
+        "analyze_texts": analyzer.analyze_texts,
+    }
+
+
+def build_stages(profile: str, include_generation: bool) -> Dict[str, Dict[str, Any]]:
+    """Stage name -> {fn, tokens_of}. Imports happen here so the profile can swap models first."""
+    if profile == "fast":
+        import stub_models
+        stub_models.install()
+
+    import analyzer
+    import rephrase
+    rephrase.MAX_NEW_TOKENS = MAX_NEW_TOKENS[profile]
+
+    neutral_scores = {"toxicity": "medium", "empathy": "low", "politeness": "low", "prosocial": "low"}
+    stages: Dict[str, Dict[str, Any]] = {
+        "score_toxicity": {"fn": analyzer.score_toxicity},
+        "score_empathy": {"fn": analyzer.score_empathy},
+        "score_politeness": {"fn": analyzer.score_politeness},
+        "score_emotions": {"fn": analyzer.score_emotions},
+        "score_sentiment": {"fn": analyzer.score_sentiment},
+        "analyze_text": {"fn": analyzer.analyze_text},
+        "generate_prompt": {"fn": lambda t: rephrase.generate_prompt(t, ["synthesized"], neutral_scores)},
+    }
+    if include_generation:
+        import main
+        from main import RephraseRequest, _rephrase
+        # warmup calls would fill the response cache and the timed pass would measure hits
+        main.response_cache.max_entries = 0
+
+        stages["get_rephrased_text"] = {
+            "fn": lambda t: rephrase.generate_with_stats(rephrase.generate_prompt(t, ["toxicity", "politeness"])),
+            "tokens_of": lambda out: out[1],
+        }
+        stages["rephrase_loop"] = {
+            "fn": lambda t: _rephrase(RephraseRequest(user_input=t, improve_toxicity=True)),
+        }
+    return stages
+
+
+def run(profile: str, corpus_fp: str, repeat: int, include_generation: bool, batch_size: int) -> Dict[str, Any]:
+    corpus = load_corpus(corpus_fp)
+
+    t0 = time.perf_counter()
+    stages = build_stages(profile, include_generation)
+    results: Dict[str, Any] = {}
+    for name, stage in stages.items():
+        # generation dominates the run time, one pass is enough for stable numbers
+        stage_repeat = 1 if "tokens_of" in stage or name == "rephrase_loop" else repeat
+        results[name] = run_stage(name, stage["fn"], corpus, stage_repeat, stage.get("tokens_of"))
+
+    batch_results: Dict[str, Any] = {}
+    for name, fn in build_batch_stages().items():
+        batch_results[name] = run_batch_stage(name, fn, corpus, repeat, batch_size)
+    separate, shared = batch_results["tokenize_separate"]["mean_ms"], batch_results["tokenize_shared"]["mean_ms"]
+    saving = 1.0 - shared / separate if separate else 0.0
+    print(f"[bench] shared tokenization saves {saving * 100:.1f}% of preprocessing time per batch")
+
+    import torch
+    import transformers
+    return {
+        "profile": profile,
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "platform": platform.platform(),
+        "corpus": os.path.basename(corpus_fp),
+        "corpus_size": len(corpus),
+        "repeat": repeat,
+        "max_new_tokens": MAX_NEW_TOKENS[profile],
+        "wall_time_s": time.perf_counter() - t0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": results,
+        "batch_stages": batch_results,
+        "preprocessing_saving": saving,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Print p50/p95 deltas per stage between two result files"""
+    print(f"[bench] comparing {old.get('commit')} -> {new.get('commit')}")
+    old_stages = {**old["stages"], **old.get("batch_stages", {})}
+    for name, cur in {**new["stages"], **new.get("batch_stages", {})}.items():
+        prev = old_stages.get(name)
+        if prev is None:
+            print(f"  {name:<22} (new stage)")
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms"):
+            change = (cur[key] - prev[key]) / prev[key] * 100.0 if prev[key] else 0.0
+            deltas.append(f"{key}={prev[key]:.2f}->{cur[key]:.2f} ({change:+.1f}%)")
+        print(f"  {name:<22} " + "  ".join(deltas))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the analyzer and rephrase pipelines")
+    ap.add_argument("--profile", choices=["fast", "full"], default="fast", help="fast = tiny stub models, full = real checkpoints")
+    ap.add_argument("--corpus", type=str, default=DEFAULT_CORPUS, help="JSONL with id/length/text fields")
+    ap.add_argument("--repeat", type=int, default=5, help="Passes over the corpus for non-generation stages")
+    ap.add_argument("--batch-size", type=int, default=16, help="Texts per batch for the batch stages")
+    ap.add_argument("--no-generation", action="store_true", help="Skip get_rephrased_text and the rephrase loop")
+    ap.add_argument("--output", type=str, default=None, help="Result JSON path (default bench_results/<profile>-<commit>.json)")
+    ap.add_argument("--compare", type=str, default=None, help="Previous result JSON to diff against")
+    args = ap.parse_args()
+
+    result = run(args.profile, args.corpus, args.repeat, not args.no_generation, args.batch_size)
+
+    out = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"{args.profile}-{result['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[bench] wrote {out} (peak RSS {result['peak_rss_mb']:.0f} MB)")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
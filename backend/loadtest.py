@@ -0,0 +1,287 @@
+"""
+Load-test harness: replays /analyze and /rephrase traffic against the FastAPI app.
+
+Each virtual typist replays a sequence of requests with their original spacing.
+Concurrency levels are run one after another (e.g. 1, 10, 50, 500 typists), and for
+every level we report latency percentiles per endpoint, error and shed (503) rates,
+and throughput, so the curves can be compared as concurrency increases.
+
+Traffic sources:
+    --trace FILE      JSONL, one request per line. Recognized fields:
+                        endpoint   "/analyze" or "/rephrase" (default: analyze, or
+                                   rephrase with probability --rephrase-ratio)
+                        t          arrival offset in seconds (default: --think-time apart)
+                        <text>     the text, field name set by --text-field
+                        improve_*  rephrase flags, passed through
+                      Any JSONL with a text field works, e.g. the repo's requests.jsonl
+                      with --text-field body.
+    (default)         synthetic keystroke-debounce traffic over bench_corpus.jsonl: the
+                      editor fires /analyze whenever the typist pauses for longer than
+                      the debounce window, and sometimes /rephrase once the message is done.
+
+Targets:
+    (default)         in-process through httpx.ASGITransport, with the stub models
+                      from stub_models.py (--backend real for the real checkpoints)
+    --url URL         a running server, e.g. http://127.0.0.1:8000
+
+Examples:
+    python loadtest.py --concurrency 1,10,50 --duration 30
+    python loadtest.py --trace ../requests.jsonl --text-field body --concurrency 5,50
+    python loadtest.py --url http://127.0.0.1:8000 --concurrency 50,500 --output load.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BASE_DIR, "bench_corpus.jsonl")
+
+ANALYZE = "/analyze"
+REPHRASE = "/rephrase"
+
+
+@dataclass
+class Event:
+    delay: float  # seconds to wait after the previous event of the same typist
+    endpoint: str
+    payload: Dict[str, Any]
+
+
+@dataclass
+class Result:
+    endpoint: str
+    status: int  # 0 for transport errors / timeouts
+    latency: float
+
+
+@dataclass
+class Level:
+    concurrency: int
+    results: List[Result] = field(default_factory=list)
+    wall: float = 0.0
+
+
+# --- traffic ---
+
+def load_trace(fp: str, text_field: str, rephrase_ratio: float, think_time: float, rng: random.Random) -> List[Event]:
+    events: List[Event] = []
+    last_t = 0.0
+    with open(fp, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            text = obj.get(text_field)
+            if not isinstance(text, str) or not text.strip():
+                continue
+            endpoint = obj.get("endpoint") or (REPHRASE if rng.random() < rephrase_ratio else ANALYZE)
+            payload = {"user_input": text}
+            payload.update({k: v for k, v in obj.items() if k.startswith("improve_")})
+            if "t" in obj:
+                delay = max(0.0, float(obj["t"]) - last_t)
+                last_t = float(obj["t"])
+            else:
+                delay = think_time
+            events.append(Event(delay, endpoint, payload))
+    return events
+
+
+def synthetic_typing(
+    corpus_fp: str,
+    rng: random.Random,
+    chars_per_s: float = 6.0,
+    debounce: float = 0.6,
+    pause_prob: float = 0.15,
+    rephrase_ratio: float = 0.3,
+) -> List[Event]:
+    """One typist writing every corpus message; /analyze fires after each pause > debounce"""
+    with open(corpus_fp, "r", encoding="utf-8") as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    rng.shuffle(texts)
+
+    events: List[Event] = []
+    pending = 0.0  # time since the last emitted event
+    for text in texts:
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            pending += (len(word) + 1) / chars_per_s
+            last_word = i == len(words) - 1
+            if last_word or rng.random() < pause_prob:
+                # the typist stops long enough for the debounce timer to fire
+                pause = debounce + rng.expovariate(1.0)
+                events.append(Event(pending + debounce, ANALYZE, {"user_input": " ".join(words[: i + 1])}))
+                pending = pause - debounce
+        if rng.random() < rephrase_ratio:
+            events.append(Event(pending + rng.uniform(1.0, 3.0), REPHRASE, {"user_input": text, "improve_toxicity": True}))
+            pending = 0.0
+        pending += rng.uniform(2.0, 8.0)  # before the next message
+    return events
+
+
+# --- driver ---
+
+async def typist(client: httpx.AsyncClient, events: List[Event], deadline: float, results: List[Result], speed: float, timeout: float):
+    for ev in events:
+        remaining = deadline - time.perf_counter()
+        if ev.delay / speed >= remaining:
+            return
+        await asyncio.sleep(ev.delay / speed)
+        start = time.perf_counter()
+        try:
+            resp = await client.post(ev.endpoint, json=ev.payload, timeout=timeout)
+            status = resp.status_code
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            status = 0
+        results.append(Result(ev.endpoint, status, time.perf_counter() - start))
+
+
+async def run_level(client: httpx.AsyncClient, streams: List[List[Event]], concurrency: int, duration: float, speed: float, timeout: float, rng: random.Random) -> Level:
+    level = Level(concurrency)
+    start = time.perf_counter()
+    deadline = start + duration
+    tasks = []
+    for i in range(concurrency):
+        events = list(streams[i % len(streams)])
+        if events:
+            # stagger typists so they don't all start in lock-step
+            events[0] = Event(events[0].delay + rng.uniform(0, 1.0), events[0].endpoint, events[0].payload)
+        tasks.append(asyncio.create_task(typist(client, events, deadline, level.results, speed, timeout)))
+    await asyncio.gather(*tasks)
+    level.wall = time.perf_counter() - start
+    return level
+
+
+# --- report ---
+
+def _pct(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    arr = np.array(values) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+    }
+
+
+def summarize(level: Level) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"concurrency": level.concurrency, "wall_s": level.wall, "endpoints": {}}
+    for endpoint in (ANALYZE, REPHRASE):
+        rs = [r for r in level.results if r.endpoint == endpoint]
+        n = len(rs)
+        ok = [r for r in rs if 200 <= r.status < 300]
+        shed = sum(1 for r in rs if r.status == 503)
+        errors = n - len(ok) - shed
+        stats = {
+            "requests": n,
+            "ok": len(ok),
+            "error_rate": errors / n if n else 0.0,
+            "shed_rate": shed / n if n else 0.0,
+            "throughput_per_s": len(ok) / level.wall if level.wall > 0 else 0.0,
+        }
+        stats.update(_pct([r.latency for r in ok]))
+        out["endpoints"][endpoint] = stats
+    return out
+
+
+def print_report(summaries: List[Dict[str, Any]]) -> None:
+    header = f"{'conc':>6} {'endpoint':<10} {'req':>6} {'ok/s':>8} {'p50ms':>9} {'p95ms':>9} {'p99ms':>9} {'err%':>6} {'shed%':>6}"
+    print(header)
+    print("-" * len(header))
+    for s in summaries:
+        for endpoint, e in s["endpoints"].items():
+            print(f"{s['concurrency']:>6} {endpoint:<10} {e['requests']:>6} {e['throughput_per_s']:>8.2f} "
+                  f"{e['p50_ms']:>9.1f} {e['p95_ms']:>9.1f} {e['p99_ms']:>9.1f} "
+                  f"{e['error_rate'] * 100:>6.1f} {e['shed_rate'] * 100:>6.1f}")
+
+
+# --- main ---
+
+def make_client(url: Optional[str], backend: str, max_new_tokens: int) -> httpx.AsyncClient:
+    if url:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        return httpx.AsyncClient(base_url=url, limits=limits)
+
+    if backend == "stub":
+        import stub_models
+        stub_models.install()
+        import rephrase
+        rephrase.MAX_NEW_TOKENS = max_new_tokens
+    import main
+    # every typist replays the same texts, a warm response cache would hide the generation load
+    main.response_cache.max_entries = 0
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest")
+
+
+def app_lifespan(url: Optional[str]):
+    """
+    ASGITransport doesn't run the app's lifespan, so run it here: the models are loaded
+    before the first level instead of inside the measurement window.
+    """
+    if url:
+        return contextlib.nullcontext()
+    import main
+    return main.app.router.lifespan_context(main.app)
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    if args.trace:
+        trace = load_trace(args.trace, args.text_field, args.rephrase_ratio, args.think_time, rng)
+        streams = [trace]
+    else:
+        # a handful of distinct typists is enough, they get reused across virtual users
+        streams = [synthetic_typing(args.corpus, rng, rephrase_ratio=args.rephrase_ratio) for _ in range(16)]
+
+    summaries = []
+    async with make_client(args.url, args.backend, args.max_new_tokens) as client, app_lifespan(args.url):
+        if not args.url:
+            # first-call overhead (allocations, kernel selection) stays out of the first level
+            await client.post(ANALYZE, json={"user_input": "warm up"}, timeout=None)
+        for concurrency in levels:
+            level = await run_level(client, streams, concurrency, args.duration, args.speed, args.timeout, rng)
+            summaries.append(summarize(level))
+            print(f"[load] concurrency={concurrency} done, {len(level.results)} requests in {level.wall:.1f}s")
+    return summaries
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay analyze/rephrase traffic against the backend")
+    ap.add_argument("--url", type=str, default=None, help="Running server; default drives the app in-process")
+    ap.add_argument("--backend", choices=["stub", "real"], default="stub", help="Models for the in-process app")
+    ap.add_argument("--max-new-tokens", type=int, default=64, help="Generation budget for the stub backend")
+    ap.add_argument("--trace", type=str, default=None, help="JSONL trace; default is synthetic keystroke-debounce traffic")
+    ap.add_argument("--text-field", type=str, default="user_input", help="Text field name in the trace")
+    ap.add_argument("--corpus", type=str, default=DEFAULT_CORPUS, help="Messages for synthetic typing")
+    ap.add_argument("--rephrase-ratio", type=float, default=0.3, help="Share of rephrase requests when not given by the trace")
+    ap.add_argument("--think-time", type=float, default=2.0, help="Gap between trace records without a t field (s)")
+    ap.add_argument("--concurrency", type=str, default="1,10,50", help="Comma separated number of concurrent typists per level")
+    ap.add_argument("--duration", type=float, default=30.0, help="Seconds per concurrency level")
+    ap.add_argument("--speed", type=float, default=1.0, help="Replay speed-up factor for arrival gaps")
+    ap.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", type=str, default=None, help="Write the summary as JSON")
+    args = ap.parse_args()
+
+    summaries = asyncio.run(run(args))
+    print_report(summaries)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": summaries}, f, indent=2)
+        print(f"[load] wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
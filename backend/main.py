@@ -1,13 +1,51 @@
-from typing import Union
-from fastapi import FastAPI
+import asyncio
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Union
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from pydantic import BaseModel
-from rephrase import get_rephrased_text, generate_prompt
+from rephrase import CandidateAborted, generate_with_stats, generate_prompt, prompt_fingerprint, _llm
+import rephrase_cache
 from fastapi.middleware.cors import CORSMiddleware
-from analyzer import analyze_text_simple, _toxicity_improve, _others_improve
+from analyzer import analyze_text_simple, score_toxicity, tokenizer_groups, toxicity_label, _toxicity_improve, _others_improve
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.responses import PlainTextResponse, Response
+from scheduler import PriorityScheduler, SchedulerFull, ANALYZE, REPHRASE
+from telemetry import (
+    REPHRASE_ABORTED, REPHRASE_ATTEMPTS, REPHRASE_FAILURES, REPHRASE_TOKENS_SAVED, REQUEST_SECONDS, REQUESTS,
+    get_logger, redact, render, request_context, span,
+)
+
+log = get_logger("main")
+
+# final /rephrase responses, see rephrase_cache.py for the REPHRASE_CACHE_* settings
+response_cache = rephrase_cache.from_env()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load all models up front so the first requests don't pay for it (or race to load them)
+    await run_in_threadpool(tokenizer_groups)
+    await run_in_threadpool(_llm)
+    yield
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+# Admission control: analyze and rephrase get separate queues so that a burst of
+# rephrase (LLM generation) requests cannot starve analyze, which runs while typing.
+# At most one generation runs at a time; the other slot is always free for analyze.
+scheduler = PriorityScheduler(
+    max_concurrent=2,
+    max_generations=1,
+    weights={ANALYZE: 4, REPHRASE: 1},
+    queue_limits={ANALYZE: None, REPHRASE: 8},
+)
 
 # CORS settings: explicitly allow Outlook and Chrome extension contexts.
 allowed_origins = [
@@ -16,11 +54,12 @@ allowed_origins = [
     "https://outlook.live.com",
     "chrome-extension://*",
 ]
+allowed_origin_regex = r"^chrome-extension://.*$"
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
-    allow_origin_regex=r"^chrome-extension://.*$",
+    allow_origin_regex=allowed_origin_regex,
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -56,14 +95,105 @@ class RephraseRequest(BaseModel):
     improve_prosocial: Union[bool, None] = None
 
 
+@app.get("/scheduler")
+async def scheduler_stats():
+    """Per-class queue depth and queue-wait percentiles"""
+    return scheduler.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+async def _run_http(cls: str, fn, req: "RephraseRequest", retry_after: str):
+    """Admit `fn(req)` through the scheduler, run it in the threadpool and record metrics"""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        async with scheduler.slot(cls):
+            # model calls are blocking, keep them off the event loop
+            return await run_in_threadpool(fn, req)
+    except SchedulerFull as e:
+        status = "shed"
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": retry_after})
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        REQUESTS.inc(endpoint=cls, status=status)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=cls)
+
+
 @app.post("/rephrase")
 async def rephrase_item(req: RephraseRequest):
-    print(f"""[INFO] Received rephrase request:
-          user_input: {req.user_input}
-          improve_toxicity: {req.improve_toxicity}
-          improve_politeness: {req.improve_politeness}
-          improve_empathy: {req.improve_empathy}
-          improve_prosocial: {req.improve_prosocial}""")
+    with request_context():
+        start = time.perf_counter()
+        cached = await run_in_threadpool(_cached_rephrase, req)
+        if cached is not None:
+            REQUESTS.inc(endpoint=REPHRASE, status="cached")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=REPHRASE)
+            return cached
+        return await _run_http(REPHRASE, _rephrase, req, retry_after="2")
+
+
+class Superseded(Exception):
+    """Raised inside a worker when a newer message of the same kind replaced this one"""
+
+
+def _check_cancel(cancel: Optional[threading.Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise Superseded()
+
+
+# Early abort (REPHRASE_EARLY_ABORT=1): score the candidate with the toxicity model at every
+# sentence boundary while it is being generated, and resample as soon as it is clearly still
+# toxic or no less toxic than the original, instead of finishing it and running all classifiers.
+EARLY_ABORT = os.environ.get("REPHRASE_EARLY_ABORT", "0") == "1"
+
+_LEVELS = {"low": 0, "medium": 1, "high": 2}
+
+# running mean length of finished candidates, used to estimate what an abort saved
+_candidate_tokens: Optional[float] = None
+
+
+# aborted candidates get their own resample budget on top of the 4 full attempts
+MAX_ABORTS = 4
+
+
+def _partial_check(initial_analysis: Dict[str, Any], goals: List[str]):
+    """
+    Abort partial candidates that are clearly toxic. "No less toxic than the original" only
+    counts when toxicity is what the user asked to fix; otherwise a candidate that keeps the
+    toxicity level but improves politeness/empathy/prosocial would still be accepted.
+    """
+    old = _LEVELS.get(initial_analysis["toxicity"], 0)
+    targets_toxicity = "toxicity" in goals or (
+        goals == ["synthesized"] and "toxicity" in initial_analysis["dimensions_to_improve"]
+    )
+
+    def check(partial: str) -> bool:
+        new = _LEVELS[toxicity_label(score_toxicity(partial))]
+        if new == _LEVELS["high"]:
+            return True
+        return targets_toxicity and old > 0 and new >= old
+    return check
+
+
+def _note_candidate_length(n_tokens: int) -> None:
+    global _candidate_tokens
+    _candidate_tokens = n_tokens if _candidate_tokens is None else 0.9 * _candidate_tokens + 0.1 * n_tokens
+
+
+def _tokens_saved(n_tokens: int) -> float:
+    # nothing to compare against until one candidate has run to completion
+    if _candidate_tokens is None:
+        return 0.0
+    return max(0.0, _candidate_tokens - n_tokens)
+
+
+def _goals(req: RephraseRequest) -> List[str]:
     goals = []
     if req.improve_toxicity:
         goals.append("toxicity")
@@ -75,28 +205,73 @@ async def rephrase_item(req: RephraseRequest):
         goals.append("pro_social")
     if len(goals) == 0:
         goals = ["synthesized"]
-        
+    return goals
+
+
+def _cached_rephrase(req: RephraseRequest) -> Optional[dict]:
+    """Cached response for `req`, looked up before admission so hits never queue behind a generation"""
+    if not response_cache.enabled:
+        return None
+    cached = response_cache.get(req.user_input, _goals(req), prompt_fingerprint())
+    if cached is not None:
+        log.info("rephrase cache hit", extra={"user_input": redact(req.user_input)})
+        cached["original_text"] = req.user_input
+    return cached
+
+
+def _rephrase(req: RephraseRequest, cancel: Optional[threading.Event] = None):
+    log.info("rephrase request", extra={
+        "user_input": redact(req.user_input),
+        "improve_toxicity": req.improve_toxicity,
+        "improve_politeness": req.improve_politeness,
+        "improve_empathy": req.improve_empathy,
+        "improve_prosocial": req.improve_prosocial,
+    })
+    goals = _goals(req)
+    # taken before generating, so the entry is stored under the prompts that produced it
+    fingerprint = prompt_fingerprint() if response_cache.enabled else None
+
     # --- perform rephrasing ---
     initial_analysis = analyze_text_simple(req.user_input)
     # start the rephrasing process
     count = 0
     success = False
     text_to_rephrase = req.user_input
+    check_partial = _partial_check(initial_analysis, goals) if EARLY_ABORT else None
+    aborted = 0
+    tokens_saved = 0.0
     while count < 4:
-        print(f"[INFO] Starting rephrasing process with goals {goals}, attempt {count + 1}.")
-        rephrased_text = get_rephrased_text(generate_prompt(
-            text_to_rephrase,
-            goals,
-            {
-                "toxicity": initial_analysis["toxicity"],
-                "empathy": initial_analysis["empathy"],
-                "politeness": initial_analysis["politeness"],
-                "pro_social": initial_analysis["prosocial"]
-            }
-        ))
-        print(f"[INFO] Rephrased text (attempt {count + 1}): {rephrased_text}")
-        # analyze the rephrased text
-        new_analysis = analyze_text_simple(rephrased_text)
+        _check_cancel(cancel)
+        log.info("starting rephrasing", extra={"goals": goals, "attempt": count + 1})
+        with span("rephrase_attempt"):
+            try:
+                rephrased_text, n_tokens = generate_with_stats(generate_prompt(
+                    text_to_rephrase,
+                    goals,
+                    {
+                        "toxicity": initial_analysis["toxicity"],
+                        "empathy": initial_analysis["empathy"],
+                        "politeness": initial_analysis["politeness"],
+                        "pro_social": initial_analysis["prosocial"]
+                    }
+                ), should_stop=cancel.is_set if cancel is not None else None, check_partial=check_partial)
+            except CandidateAborted as e:
+                # resample from the same input, a truncated candidate is not worth iterating on.
+                # Aborts have their own budget instead of using up one of the 4 attempts; once
+                # it is spent the remaining attempts run to completion.
+                aborted += 1
+                tokens_saved += _tokens_saved(e.n_tokens)
+                REPHRASE_ABORTED.inc()
+                log.info("candidate aborted", extra={"attempt": count + 1, "tokens": e.n_tokens, "partial": redact(e.partial)})
+                if aborted >= MAX_ABORTS:
+                    check_partial = None
+                continue
+            # generation may have been aborted half-way, don't score a truncated candidate
+            _check_cancel(cancel)
+            _note_candidate_length(n_tokens)
+            log.info("rephrased text", extra={"attempt": count + 1, "tokens": n_tokens, "rephrased_text": redact(rephrased_text)})
+            # analyze the rephrased text
+            new_analysis = analyze_text_simple(rephrased_text)
         if not new_analysis["should_rewrite"]:
             success = True
             break
@@ -110,9 +285,14 @@ async def rephrase_item(req: RephraseRequest):
             break
         text_to_rephrase = rephrased_text
         count += 1
+    REPHRASE_ATTEMPTS.observe(count + 1 if success else count)
+    if EARLY_ABORT:
+        REPHRASE_TOKENS_SAVED.observe(tokens_saved)
+        log.info("early abort summary", extra={"aborted": aborted, "tokens_saved": round(tokens_saved)})
     # after max 4 attempts
     if not success:
-        print("[WARN] Rephrasing attempts exhausted without satisfactory improvement.")
+        REPHRASE_FAILURES.inc()
+        log.warning("rephrasing attempts exhausted without satisfactory improvement", extra={"attempts": count})
         rephrased_text = "Sorry, we couldn't improve the text after multiple attempts. Please try rephrasing it manually."
         new_analysis = {
             "toxicity": "N/A",
@@ -120,7 +300,7 @@ async def rephrase_item(req: RephraseRequest):
             "politeness": "N/A",
             "prosocial": "N/A"
         }
-    return {
+    response = {
         "original_text": req.user_input,
         "old_toxicity": initial_analysis["toxicity"],
         "old_empathy": initial_analysis["empathy"],
@@ -132,13 +312,22 @@ async def rephrase_item(req: RephraseRequest):
         "new_proSocial": new_analysis["prosocial"],
         "rephrased_text": rephrased_text.strip()
     }
+    # failures are not cached, another round of sampling may still succeed
+    if success and fingerprint is not None:
+        response_cache.put(req.user_input, goals, fingerprint, response)
+    return response
 
 @app.post("/analyze")
 async def analyze_item(req: RephraseRequest):
-    print(f"""[INFO] Received analyze request:
-          user_input: {req.user_input}""")
+    with request_context():
+        return await _run_http(ANALYZE, _analyze, req, retry_after="1")
+
+
+def _analyze(req: RephraseRequest, cancel: Optional[threading.Event] = None):
+    log.info("analyze request", extra={"user_input": redact(req.user_input)})
+    _check_cancel(cancel)
     initial_analysis = analyze_text_simple(req.user_input)
-    print(f"[INFO] Analysis results: {initial_analysis}")
+    log.info("analysis results", extra={"analysis": initial_analysis})
     # if(initial_analysis["should_rewrite"]):
     #     # start the rephrasing process
     #     count = 0
@@ -202,4 +391,127 @@ async def analyze_item(req: RephraseRequest):
         # "new_politeness": new_analysis["politeness"],
         # "new_proSocial": new_analysis["prosocial"],
         # "rephrased_text": rephrased_text
-    }
\ No newline at end of file
+    }
+
+
+# --- WebSocket channel ---
+# One long-lived connection per editor. Client messages look like
+#   {"id": 12, "type": "analyze", "user_input": "..."}
+#   {"id": 13, "type": "rephrase", "user_input": "...", "improve_toxicity": true, ...}
+#   {"id": 13, "type": "cancel"}
+# `id` is a per-connection sequence number that increases with every message. A new
+# analyze/rephrase message supersedes any older one of the same type: queued work is
+# dropped, running generation is stopped through a stopping criterion, and no reply is
+# sent for superseded ids. Replies look like
+#   {"id": 12, "type": "analyze", "ok": true, "result": {...}}
+#   {"id": 13, "type": "rephrase", "ok": false, "status": 503, "error": "..."}
+
+_WS_WORKERS = {ANALYZE: _analyze, REPHRASE: _rephrase}
+
+
+class _Job:
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.cancel = threading.Event()
+        self.started = False
+        self.task: Optional[asyncio.Task] = None
+
+    def supersede(self):
+        self.cancel.set()
+        # a job already in the threadpool must finish cooperatively so it keeps its
+        # scheduler slot until the model call returns; queued jobs can just be dropped
+        if self.task is not None and not self.started:
+            self.task.cancel()
+
+
+def _origin_allowed(origin: Optional[str]) -> bool:
+    # CORS doesn't apply to WebSockets, so /ws checks the same origins itself. Browsers always
+    # send Origin on a WebSocket handshake; clients without one (scripts, tests) can already
+    # reach the HTTP routes directly.
+    if origin is None:
+        return True
+    return origin in allowed_origins or re.match(allowed_origin_regex, origin) is not None
+
+
+@app.websocket("/ws")
+async def editor_channel(ws: WebSocket):
+    if not _origin_allowed(ws.headers.get("origin")):
+        log.warning("rejected /ws connection", extra={"origin": ws.headers.get("origin")})
+        await ws.close(code=1008)
+        return
+    await ws.accept()
+    conn_id = uuid.uuid4().hex[:8]
+    latest: Dict[str, _Job] = {}
+    # highest id seen per kind; outlives the job so late, older ids are still dropped
+    highest: Dict[str, int] = {}
+    send_lock = asyncio.Lock()
+
+    async def reply(msg: dict):
+        async with send_lock:
+            try:
+                await ws.send_json(msg)
+            except (WebSocketDisconnect, RuntimeError):
+                pass  # client went away, nothing left to tell it
+
+    async def run(kind: str, job: _Job, req: RephraseRequest):
+        with request_context(f"ws-{conn_id}-{job.seq}"):
+            await _run_job(kind, job, req)
+
+    async def _run_job(kind: str, job: _Job, req: RephraseRequest):
+        try:
+            if kind == REPHRASE:
+                cached = await run_in_threadpool(_cached_rephrase, req)
+                if cached is not None:
+                    if not job.cancel.is_set():
+                        await reply({"id": job.seq, "type": kind, "ok": True, "result": cached})
+                    return
+            async with scheduler.slot(kind):
+                _check_cancel(job.cancel)
+                job.started = True
+                result = await run_in_threadpool(_WS_WORKERS[kind], req, job.cancel)
+            if not job.cancel.is_set():
+                await reply({"id": job.seq, "type": kind, "ok": True, "result": result})
+        except (Superseded, asyncio.CancelledError):
+            pass
+        except SchedulerFull as e:
+            await reply({"id": job.seq, "type": kind, "ok": False, "status": 503, "error": str(e)})
+        except Exception as e:
+            log.exception("websocket request failed", extra={"kind": kind, "seq": job.seq})
+            await reply({"id": job.seq, "type": kind, "ok": False, "status": 500, "error": str(e)})
+        finally:
+            if latest.get(kind) is job:
+                del latest[kind]
+
+    try:
+        while True:
+            msg = await ws.receive_json()
+            seq = msg.get("id")
+            kind = msg.get("type")
+            if kind == "cancel":
+                for job in list(latest.values()):
+                    if seq is None or job.seq == seq:
+                        job.supersede()
+                continue
+            if kind not in _WS_WORKERS or not isinstance(seq, int):
+                await reply({"id": seq, "type": kind, "ok": False, "status": 400, "error": "bad message"})
+                continue
+            try:
+                req = RephraseRequest(**{k: v for k, v in msg.items() if k not in ("id", "type")})
+            except ValidationError as e:
+                await reply({"id": seq, "type": kind, "ok": False, "status": 422, "error": str(e)})
+                continue
+
+            if seq <= highest.get(kind, seq - 1):  # stale message arrived late
+                continue
+            highest[kind] = seq
+            previous = latest.get(kind)
+            if previous is not None:
+                previous.supersede()
+            job = _Job(seq)
+            latest[kind] = job
+            job.task = asyncio.create_task(run(kind, job, req))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for job in list(latest.values()):
+            job.supersede()
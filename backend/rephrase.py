@@ -1,34 +1,87 @@
 from email.mime import text
+import argparse
+import hashlib
 import json
 import os
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+
+from telemetry import GENERATED_TOKENS, span, timed_load
 
 model_name = "Qwen/Qwen2.5-7B-Instruct"
+MAX_NEW_TOKENS = 512
+
+_model = None
+_tokenizer = None
+_llm_lock = threading.Lock()
+
 
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    torch_dtype="auto",
-    device_map="auto"
-)
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+def _llm():
+    """Load rephrasing model"""
+    global _model, _tokenizer
+    if _model is None or _tokenizer is None:
+        with _llm_lock:
+            # another request may have loaded it while we waited
+            if _model is None or _tokenizer is None:
+                with timed_load("generator"):
+                    _model = AutoModelForCausalLM.from_pretrained(
+                        model_name,
+                        torch_dtype="auto",
+                        device_map="auto"
+                    )
+                    _tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return _tokenizer, _model
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-with open(os.path.join(BASE_DIR, "prompts/system.txt"), "r") as f:
-    SYSTEM_PROMPT = f.read()
-    f.close()
-
-with open(os.path.join(BASE_DIR, "prompts/specific.txt"), "r") as f:
-    specific_prompt = f.read()
-    f.close()
-    
-with open(os.path.join(BASE_DIR, "prompts/synthesized.txt"), "r") as f:
-    synthesized_prompt = f.read()
-    f.close()
-    
-with open(os.path.join(BASE_DIR, "prompts/instructions.json"), "r") as f:
-    instructions = json.load(f)
-    f.close()
+PROMPT_FILES = ["prompts/system.txt", "prompts/specific.txt", "prompts/synthesized.txt", "prompts/instructions.json"]
+
+_prompt_mtimes: Dict[str, float] = {}
+_prompt_hash = ""
+
+
+def _load_prompts():
+    """(Re)load the prompt templates and remember their mtimes and content hash"""
+    global SYSTEM_PROMPT, specific_prompt, synthesized_prompt, instructions, _prompt_hash
+    contents = {}
+    for name in PROMPT_FILES:
+        fp = os.path.join(BASE_DIR, name)
+        _prompt_mtimes[name] = os.path.getmtime(fp)
+        with open(fp, "r") as f:
+            contents[name] = f.read()
+
+    SYSTEM_PROMPT = contents["prompts/system.txt"]
+    specific_prompt = contents["prompts/specific.txt"]
+    synthesized_prompt = contents["prompts/synthesized.txt"]
+    instructions = json.loads(contents["prompts/instructions.json"])
+    _prompt_hash = hashlib.sha256(json.dumps(contents, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# generation_config fields that change what the model samples
+SAMPLING_KEYS = ("do_sample", "temperature", "top_p", "top_k", "repetition_penalty")
+
+
+def prompt_fingerprint() -> str:
+    """
+    Hash of the prompt templates and generation settings (model, token budget and the
+    model's sampling config). Prompt files that changed on disk since they were loaded
+    are reloaded first, so the fingerprint follows edits.
+    """
+    if any(os.path.getmtime(os.path.join(BASE_DIR, name)) != mtime for name, mtime in _prompt_mtimes.items()):
+        _load_prompts()
+    # never load the model just for this; nothing can be cached before it has generated
+    sampling = None
+    if _model is not None:
+        sampling = {k: getattr(_model.generation_config, k, None) for k in SAMPLING_KEYS}
+    settings = {"model": model_name, "max_new_tokens": MAX_NEW_TOKENS, "sampling": sampling}
+    return hashlib.sha256((_prompt_hash + json.dumps(settings, sort_keys=True)).encode("utf-8")).hexdigest()
+
+
+_load_prompts()
 
 def generate_prompt(user_input: str, goal: list, scores: dict = None) -> str:
     if goal == ["synthesized"] and scores is not None:
@@ -51,31 +104,277 @@ def generate_prompt(user_input: str, goal: list, scores: dict = None) -> str:
         prompt = prompt.replace("<<TASK_INSTRUCTION>>", instructions_prompt.strip())
     return prompt
 
-def get_rephrased_text(user_prompt: str) -> str:
+class _StopWhen(StoppingCriteria):
+    """Stop generation as soon as `should_stop()` returns True (e.g. request was superseded)"""
+
+    def __init__(self, should_stop: Callable[[], bool]):
+        self.should_stop = should_stop
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), bool(self.should_stop()), dtype=torch.bool, device=input_ids.device)
+
+
+class CandidateAborted(Exception):
+    """Raised by generate_with_stats when `check_partial` rejected the candidate mid-generation"""
+
+    def __init__(self, partial: str, n_tokens: int):
+        super().__init__(f"candidate aborted after {n_tokens} tokens")
+        self.partial = partial
+        self.n_tokens = n_tokens
+
+
+SENTENCE_END = (".", "!", "?", "\n")
+
+
+class _AbortPartial(StoppingCriteria):
+    """
+    At every sentence boundary, decode the output so far and stop if `check_partial(text)`
+    returns True. Sentence boundaries keep the number of classifier calls small and avoid
+    scoring half a clause.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, check_partial: Callable[[str], bool]):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.check_partial = check_partial
+        self.aborted = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        last = self.tokenizer.decode(input_ids[0, -1:], skip_special_tokens=True)
+        if not self.aborted and last.rstrip(" \"'\u201d)").endswith(SENTENCE_END):
+            partial = self.tokenizer.decode(input_ids[0, self.prompt_len:], skip_special_tokens=True).strip()
+            if partial:
+                with span("partial_check", model="generator"):
+                    self.aborted = bool(self.check_partial(partial))
+        return torch.full((input_ids.shape[0],), self.aborted, dtype=torch.bool, device=input_ids.device)
+
+
+def get_rephrased_text(
+    user_prompt: str,
+    should_stop: Optional[Callable[[], bool]] = None,
+    check_partial: Optional[Callable[[str], bool]] = None,
+) -> str:
+    return generate_with_stats(user_prompt, should_stop, check_partial)[0]
+
+
+def _chat_text(tokenizer, user_prompt: str) -> str:
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt}
     ]
-    text = tokenizer.apply_chat_template(
+    return tokenizer.apply_chat_template(
         messages,
         tokenize=False,
         add_generation_prompt=True
     )
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
 
-    generated_ids = model.generate(
-        **model_inputs,
-        max_new_tokens=512
-    )
+
+def generate_with_stats(
+    user_prompt: str,
+    should_stop: Optional[Callable[[], bool]] = None,
+    check_partial: Optional[Callable[[str], bool]] = None,
+) -> Tuple[str, int]:
+    """
+    Same as get_rephrased_text, also returns the number of generated tokens.
+    Raises CandidateAborted if `check_partial` stopped the generation.
+    """
+    tokenizer, model = _llm()
+    with span("tokenize", model="generator"):
+        text = _chat_text(tokenizer, user_prompt)
+        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+
+    criteria = []
+    if should_stop is not None:
+        criteria.append(_StopWhen(should_stop))
+    abort = None
+    if check_partial is not None:
+        abort = _AbortPartial(tokenizer, model_inputs.input_ids.shape[1], check_partial)
+        criteria.append(abort)
+    stopping_criteria = StoppingCriteriaList(criteria) if criteria else None
+    with span("generate", model="generator"):
+        generated_ids = model.generate(
+            **model_inputs,
+            max_new_tokens=MAX_NEW_TOKENS,
+            stopping_criteria=stopping_criteria
+        )
     generated_ids = [
         output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
     ]
 
     response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-    return response
+    GENERATED_TOKENS.inc(len(generated_ids[0]))
+    if abort is not None and abort.aborted:
+        raise CandidateAborted(response, len(generated_ids[0]))
+    return response, len(generated_ids[0])
+
+
+def generate_batch(user_prompts: List[str]) -> List[Tuple[str, int]]:
+    """
+    Batched generate_with_stats. Prompts are left-padded to the longest one in the batch,
+    so callers should group prompts of similar length.
+    """
+    tokenizer, model = _llm()
+    with span("tokenize", model="generator"):
+        texts = [_chat_text(tokenizer, p) for p in user_prompts]
+        # decoder-only models continue from the last position, so pad on the left
+        model_inputs = tokenizer(texts, return_tensors="pt", padding=True, padding_side="left").to(model.device)
+
+    with span("generate", model="generator"):
+        generated_ids = model.generate(
+            **model_inputs,
+            max_new_tokens=MAX_NEW_TOKENS,
+            pad_token_id=tokenizer.pad_token_id
+        )
+    new_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+
+    responses = tokenizer.batch_decode(new_ids, skip_special_tokens=True)
+    # finished rows are filled with padding up to the longest one
+    counts = [int((row != tokenizer.pad_token_id).sum()) for row in new_ids]
+    GENERATED_TOKENS.inc(sum(counts))
+    return list(zip(responses, counts))
+
+
+# --- offline bulk mode ---
+
+def _read_done(out_fp: str) -> set:
+    """
+    ids already written to `out_fp` by a previous (possibly interrupted) run. A torn last
+    line without its newline is cut off, so new records are not appended onto it.
+    """
+    done = set()
+    if not os.path.exists(out_fp):
+        return done
+    complete = 0  # byte offset just after the last newline
+    with open(out_fp, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            complete += len(line)
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                continue
+        f.truncate(complete)
+    return done
+
+
+def _read_records(fp: str, text_field: str) -> Iterator[Dict[str, Any]]:
+    with open(fp, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            text = obj.get(text_field)
+            if not isinstance(text, str) or not text.strip():
+                continue
+            obj.setdefault("id", n)
+            obj["_text"] = text.strip()
+            yield obj
+
+
+SCORE_KEYS = ("toxicity", "empathy", "politeness", "prosocial")
+
+
+def _has_scores(scores: Any) -> bool:
+    return isinstance(scores, dict) and all(k in scores for k in SCORE_KEYS)
+
+
+def _rephrase_window(records: List[Dict[str, Any]], batch_size: int, out) -> int:
+    """Rephrase one window of records in length-sorted batches, appending results to `out`"""
+    from analyzer import analyze_texts_simple, _toxicity_improve, _others_improve
+
+    # records without complete precomputed scores (e.g. "pro_social" instead of "prosocial")
+    # are analyzed in one batch
+    missing = [r for r in records if not _has_scores(r.get("scores"))]
+    if missing:
+        for r, a in zip(missing, analyze_texts_simple([r["_text"] for r in missing])):
+            r["scores"] = {k: a[k] for k in SCORE_KEYS}
+
+    for r in records:
+        r["_prompt"] = generate_prompt(r["_text"], r.get("goals") or ["synthesized"], r["scores"])
+    records = sorted(records, key=lambda r: len(r["_prompt"]))
+
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        outputs = generate_batch([r["_prompt"] for r in batch])
+        texts = [text.strip() for text, _ in outputs]
+        scored = [t for t in texts if t]
+        analyses = iter(analyze_texts_simple(scored) if scored else [])
+        for r, text, (_, n_tokens) in zip(batch, texts, outputs):
+            new = next(analyses) if text else None
+            old = r["scores"]
+            improved = new is not None and (
+                not new["should_rewrite"] or
+                _toxicity_improve(old["toxicity"], new["toxicity"]) or
+                _others_improve(old["empathy"], new["empathy"]) or
+                _others_improve(old["politeness"], new["politeness"]) or
+                _others_improve(old["prosocial"], new["prosocial"])
+            )
+            out.write(json.dumps({
+                "id": r["id"],
+                "original_text": r["_text"],
+                "goals": r.get("goals") or ["synthesized"],
+                "old_scores": old,
+                "rephrased_text": text,
+                "new_scores": new,
+                "improved": bool(improved),
+                "generated_tokens": n_tokens,
+            }, ensure_ascii=False) + "\n")
+        # checkpoint: everything written so far survives a crash / kill
+        out.flush()
+        os.fsync(out.fileno())
+    return len(records)
+
+
+def bulk_rephrase(in_fp: str, out_fp: str, text_field: str = "text", batch_size: int = 8, window: int = 256) -> Dict[str, float]:
+    """
+    Rephrase every record of a JSONL file into `out_fp` (JSONL, one line per input id).
+    Records may carry "goals" (list for generate_prompt) and "scores" (label dict); missing
+    scores are computed with the analyzer. Re-running with the same `out_fp` resumes.
+    """
+    done = _read_done(out_fp)
+    start = time.perf_counter()
+    processed = 0
+    skipped = 0
+    with open(out_fp, "a", encoding="utf-8") as out:
+        pending: List[Dict[str, Any]] = []
+        for record in _read_records(in_fp, text_field):
+            if record["id"] in done:
+                skipped += 1
+                continue
+            pending.append(record)
+            if len(pending) >= window:
+                processed += _rephrase_window(pending, batch_size, out)
+                pending = []
+                print(f"[bulk] {processed} rephrased ({skipped} already done)")
+        if pending:
+            processed += _rephrase_window(pending, batch_size, out)
+
+    elapsed = time.perf_counter() - start
+    per_hour = processed / elapsed * 3600.0 if elapsed > 0 else 0.0
+    print(f"[bulk] {processed} messages in {elapsed:.1f}s ({per_hour:.0f} messages/hour), {skipped} skipped from a previous run")
+    return {"processed": processed, "skipped": skipped, "seconds": elapsed, "messages_per_hour": per_hour}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rephrase a single sentence, or a JSONL corpus in bulk")
+    ap.add_argument("--jsonl", type=str, default=None, help="Input JSONL; each record needs a text field, optional goals/scores")
+    ap.add_argument("--out", type=str, default=None, help="Output JSONL, appended to and resumed from")
+    ap.add_argument("--text-field", type=str, default="text", help="Field name for JSONL")
+    ap.add_argument("--batch-size", type=int, default=8, help="Prompts per generate() call")
+    ap.add_argument("--window", type=int, default=256, help="Records read, length-sorted and checkpointed together")
+    args = ap.parse_args()
+
+    if args.jsonl is None:
+        test_input = "Your service is terrible and I hate it!"
+        rephrased_output = get_rephrased_text(test_input)
+        print("Original:", test_input)
+        print("Rephrased:", rephrased_output)
+        return
+    if args.out is None:
+        ap.error("--out is required with --jsonl")
+    bulk_rephrase(args.jsonl, args.out, args.text_field, args.batch_size, args.window)
+
 
 if __name__ == "__main__":
-    test_input = "Your service is terrible and I hate it!"
-    rephrased_output = get_rephrased_text(test_input)
-    print("Original:", test_input)
-    print("Rephrased:", rephrased_output)
\ No newline at end of file
+    main()
@@ -0,0 +1,145 @@
+"""
+Cache for final /rephrase responses.
+
+Keys combine the normalized input text, the selected goals and rephrase.prompt_fingerprint()
+(prompt templates, instructions.json and generation settings). Editing a prompt file changes
+the fingerprint, which clears the in-memory tier and makes old disk entries unreachable
+(they are pruned on the next write).
+
+Tiers:
+    memory  LRU, bounded by REPHRASE_CACHE_SIZE entries (default 1024, 0 disables the cache)
+    disk    optional sqlite file at REPHRASE_CACHE_DB, bounded by REPHRASE_CACHE_DISK_SIZE
+            entries (default 100000), least recently used rows are evicted first
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from telemetry import REPHRASE_CACHE_HITS, REPHRASE_CACHE_MISSES
+
+
+def normalize(text: str) -> str:
+    """Unicode NFC and collapsed whitespace. Case is kept on purpose, "FIX IT NOW" reads differently."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(text: str, goals: List[str], fingerprint: str) -> str:
+    payload = json.dumps({"text": normalize(text), "goals": sorted(goals), "fingerprint": fingerprint}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RephraseCache:
+    def __init__(self, max_entries: int = 1024, disk_path: Optional[str] = None, max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_fingerprint: Optional[str] = None
+        self._disk_rows = 0
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rephrase_cache ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT, used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS rephrase_cache_fingerprint ON rephrase_cache (fingerprint)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS rephrase_cache_used ON rephrase_cache (used)")
+            self._db.commit()
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM rephrase_cache").fetchone()[0]
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        # prompts or settings changed: nothing in memory can be reused
+        if fingerprint != self._fingerprint:
+            self._memory.clear()
+            self._fingerprint = fingerprint
+
+    def get(self, text: str, goals: List[str], fingerprint: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        key = make_key(text, goals, fingerprint)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                REPHRASE_CACHE_HITS.inc(tier="memory")
+                return dict(value)
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM rephrase_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE rephrase_cache SET used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._put_memory(key, value)
+                    REPHRASE_CACHE_HITS.inc(tier="disk")
+                    return dict(value)
+        REPHRASE_CACHE_MISSES.inc()
+        return None
+
+    def put(self, text: str, goals: List[str], fingerprint: str, value: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        key = make_key(text, goals, fingerprint)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._put_memory(key, dict(value))
+            if self._db is not None:
+                self._put_disk(key, fingerprint, value)
+
+    def _put_disk(self, key: str, fingerprint: str, value: Dict[str, Any]) -> None:
+        if fingerprint != self._disk_fingerprint:
+            # first write under a new prompt version: rows from older versions are unreachable
+            self._db.execute("DELETE FROM rephrase_cache WHERE fingerprint != ?", (fingerprint,))
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM rephrase_cache").fetchone()[0]
+            self._disk_fingerprint = fingerprint
+        exists = self._db.execute("SELECT 1 FROM rephrase_cache WHERE key = ?", (key,)).fetchone() is not None
+        self._db.execute(
+            "INSERT OR REPLACE INTO rephrase_cache (key, fingerprint, value, used) VALUES (?, ?, ?, ?)",
+            (key, fingerprint, json.dumps(value), time.time()),
+        )
+        if not exists:
+            self._disk_rows += 1
+        if self._disk_rows > self.max_disk_entries:
+            self._db.execute(
+                "DELETE FROM rephrase_cache WHERE key IN ("
+                "SELECT key FROM rephrase_cache ORDER BY used LIMIT ?)",
+                (self._disk_rows - self.max_disk_entries,),
+            )
+            self._disk_rows = self.max_disk_entries
+        self._db.commit()
+
+    def _put_memory(self, key: str, value: Dict[str, Any]) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM rephrase_cache")
+                self._db.commit()
+                self._disk_rows = 0
+
+
+def from_env() -> RephraseCache:
+    return RephraseCache(
+        max_entries=int(os.environ.get("REPHRASE_CACHE_SIZE", "1024")),
+        disk_path=os.environ.get("REPHRASE_CACHE_DB") or None,
+        max_disk_entries=int(os.environ.get("REPHRASE_CACHE_DISK_SIZE", "100000")),
+    )
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+import numpy as np
+
+from telemetry import QUEUE_WAIT_SECONDS, SCHEDULER_REJECTED
+
+
+# Endpoint classes. "analyze" is latency critical (it runs while the user is typing),
+# "rephrase" is an explicit user action and is allowed to wait / be shed.
+ANALYZE = "analyze"
+REPHRASE = "rephrase"
+
+DEFAULT_WEIGHTS = {ANALYZE: 4, REPHRASE: 1}
+DEFAULT_QUEUE_LIMITS = {ANALYZE: None, REPHRASE: 8}
+
+
+class SchedulerFull(Exception):
+    """Raised when a request is shed because its class queue is over its bound"""
+
+    def __init__(self, cls: str, limit: int):
+        super().__init__(f"{cls} queue is full ({limit} waiting)")
+        self.cls = cls
+        self.limit = limit
+
+
+class PriorityScheduler:
+    """
+    Admission scheduler with one FIFO queue per endpoint class.
+
+    - `max_concurrent` bounds the total number of requests doing model work.
+    - `max_generations` bounds how many of those slots "rephrase" (LLM generation) may
+      hold at once, so with max_concurrent > max_generations a slot is always left for
+      "analyze" even when rephrase is saturated.
+    - When a slot frees up, the next waiting class is picked by smooth weighted
+      round-robin over `weights`.
+    - Classes with a queue limit fail fast with SchedulerFull instead of queueing.
+
+    Usage:
+        async with scheduler.slot("analyze"):
+            ...
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 2,
+        max_generations: int = 1,
+        weights: Optional[Dict[str, int]] = None,
+        queue_limits: Optional[Dict[str, Optional[int]]] = None,
+        wait_window: int = 1024,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_generations = max_generations
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.queue_limits = dict(queue_limits or DEFAULT_QUEUE_LIMITS)
+
+        self._queues: Dict[str, Deque[asyncio.Future]] = {c: deque() for c in self.weights}
+        self._current_weight: Dict[str, int] = {c: 0 for c in self.weights}
+        self._active: Dict[str, int] = {c: 0 for c in self.weights}
+        self._waits: Dict[str, Deque[float]] = {c: deque(maxlen=wait_window) for c in self.weights}
+        self._admitted: Dict[str, int] = {c: 0 for c in self.weights}
+        self._rejected: Dict[str, int] = {c: 0 for c in self.weights}
+
+    # --- internal helpers ---
+
+    def _running(self) -> int:
+        return sum(self._active.values())
+
+    def _can_run(self, cls: str) -> bool:
+        if self._running() >= self.max_concurrent:
+            return False
+        if cls == REPHRASE and self._active[REPHRASE] >= self.max_generations:
+            return False
+        return True
+
+    def _pick_next(self) -> Optional[str]:
+        """Smooth weighted round-robin over classes that have waiters and may run now"""
+        eligible = [c for c, q in self._queues.items() if q and self._can_run(c)]
+        if not eligible:
+            return None
+        total = sum(self.weights[c] for c in eligible)
+        for c in eligible:
+            self._current_weight[c] += self.weights[c]
+        best = max(eligible, key=lambda c: self._current_weight[c])
+        self._current_weight[best] -= total
+        return best
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters until nothing else can be admitted"""
+        while True:
+            cls = self._pick_next()
+            if cls is None:
+                return
+            fut = self._queues[cls].popleft()
+            if fut.done():  # waiter was cancelled while queued
+                continue
+            self._active[cls] += 1
+            fut.set_result(None)
+
+    # --- public API ---
+
+    @asynccontextmanager
+    async def slot(self, cls: str):
+        """Wait for a slot for `cls`, hold it for the body of the `async with`"""
+        if cls not in self._queues:
+            raise ValueError(f"Unknown request class: {cls}")
+
+        enqueued = time.perf_counter()
+        queue = self._queues[cls]
+        if not queue and self._can_run(cls):
+            self._active[cls] += 1
+        else:
+            limit = self.queue_limits.get(cls)
+            if limit is not None and len(queue) >= limit:
+                self._rejected[cls] += 1
+                SCHEDULER_REJECTED.inc(cls=cls)
+                raise SchedulerFull(cls, limit)
+            fut = asyncio.get_running_loop().create_future()
+            queue.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # slot was granted right as we got cancelled, give it back
+                    self._active[cls] -= 1
+                    self._dispatch()
+                else:
+                    try:
+                        queue.remove(fut)
+                    except ValueError:
+                        pass
+                raise
+
+        waited = time.perf_counter() - enqueued
+        self._waits[cls].append(waited)
+        QUEUE_WAIT_SECONDS.observe(waited, cls=cls)
+        self._admitted[cls] += 1
+        try:
+            yield
+        finally:
+            self._active[cls] -= 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-class queue-wait percentiles (ms) over the recent window and counters"""
+        out = {}
+        for cls, waits in self._waits.items():
+            arr = np.array(waits, dtype=float) * 1000.0
+            out[cls] = {
+                "queued": len(self._queues[cls]),
+                "active": self._active[cls],
+                "admitted": self._admitted[cls],
+                "rejected": self._rejected[cls],
+                "wait_ms_p50": float(np.percentile(arr, 50)) if arr.size else 0.0,
+                "wait_ms_p95": float(np.percentile(arr, 95)) if arr.size else 0.0,
+                "wait_ms_p99": float(np.percentile(arr, 99)) if arr.size else 0.0,
+            }
+        return out
@@ -0,0 +1,143 @@
+"""
+Tiny randomly initialized stand-ins for the analyzer and rephrase checkpoints.
+
+They have the same architectures / label sets as the real models, but only a few
+hundred KB of weights, so benchmarks and load tests can run offline on any Linux box.
+Scores and rephrasings produced by them are meaningless, only the timing is useful.
+
+Usage:
+    import stub_models
+    stub_models.install()   # before the first analyzer / rephrase call
+"""
+from __future__ import annotations
+
+import glob
+import os
+import re
+import string
+import tempfile
+from typing import Dict, Optional
+
+import torch
+from transformers import (
+    BertConfig,
+    BertForSequenceClassification,
+    BertTokenizerFast,
+    GenerationConfig,
+    Qwen2Config,
+    Qwen2ForCausalLM,
+)
+
+import analyzer
+import rephrase
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Label sets copied from the real checkpoints
+TOXIC_LABELS = ["toxic", "severe_toxic", "obscene", "threat", "insult", "identity_hate"]
+EMOTION_LABELS = ["sadness", "joy", "love", "anger", "fear", "surprise"]
+EMPATHY_LABELS = ["LABEL_0", "LABEL_1"]
+POLITENESS_LABELS = ["impolite", "polite"]
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}[{{ message['role'] }}] {{ message['content'] }}\n{% endfor %}"
+    "{% if add_generation_prompt %}[assistant] {% endif %}"
+)
+
+_installed: Optional[Dict[str, str]] = None
+
+
+def _vocab() -> list:
+    """Word-level vocab built from the prompts and benchmark corpus, plus characters as a fallback"""
+    words = set()
+    for fp in glob.glob(os.path.join(BASE_DIR, "prompts", "*")) + [os.path.join(BASE_DIR, "bench_corpus.jsonl")]:
+        if os.path.exists(fp):
+            with open(fp, "r", encoding="utf-8") as f:
+                words.update(w.lower() for w in re.findall(r"[A-Za-z]+", f.read()))
+    chars = string.ascii_lowercase + string.digits + string.punctuation
+    specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    tokens = specials + list(chars) + ["##" + c for c in string.ascii_lowercase + string.digits]
+    return tokens + sorted(words - set(tokens))
+
+
+def _tokenizer(vocab_file: str, lowercase: bool, **kwargs) -> BertTokenizerFast:
+    tok = BertTokenizerFast(vocab_file=vocab_file, do_lower_case=lowercase, **kwargs)
+    tok.model_max_length = 512
+    return tok
+
+
+def _classifier(out_dir: str, vocab_file: str, labels: list, lowercase: bool = True, problem_type: Optional[str] = None):
+    tok = _tokenizer(vocab_file, lowercase)
+    config = BertConfig(
+        vocab_size=len(tok),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=512,
+        num_labels=len(labels),
+        id2label=dict(enumerate(labels)),
+        label2id={l: i for i, l in enumerate(labels)},
+        problem_type=problem_type,
+    )
+    BertForSequenceClassification(config).save_pretrained(out_dir)
+    tok.save_pretrained(out_dir)
+
+
+def _generator(out_dir: str, vocab_file: str):
+    # like the Qwen tokenizer, don't emit token_type_ids (generate() rejects them)
+    tok = _tokenizer(vocab_file, lowercase=True, model_input_names=["input_ids", "attention_mask"])
+    tok.chat_template = CHAT_TEMPLATE
+    config = Qwen2Config(
+        vocab_size=len(tok),
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        pad_token_id=tok.pad_token_id,
+        bos_token_id=tok.cls_token_id,
+        eos_token_id=tok.sep_token_id,
+    )
+    model = Qwen2ForCausalLM(config)
+    model.generation_config = GenerationConfig(
+        pad_token_id=tok.pad_token_id,
+        bos_token_id=tok.cls_token_id,
+        eos_token_id=tok.sep_token_id,
+        do_sample=True,
+        top_k=50,
+    )
+    model.save_pretrained(out_dir)
+    tok.save_pretrained(out_dir)
+
+
+def build(root: str, seed: int = 0) -> Dict[str, str]:
+    """Write all stub checkpoints under `root` and return their paths"""
+    torch.manual_seed(seed)
+    os.makedirs(root, exist_ok=True)
+    vocab_file = os.path.join(root, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(_vocab()) + "\n")
+
+    paths = {name: os.path.join(root, name) for name in ("toxic", "emotion", "empathy", "politeness", "generator")}
+    _classifier(paths["toxic"], vocab_file, TOXIC_LABELS, problem_type="multi_label_classification")
+    _classifier(paths["emotion"], vocab_file, EMOTION_LABELS)
+    _classifier(paths["empathy"], vocab_file, EMPATHY_LABELS)
+    # the real politeness model is xlm-roberta with its own tokenizer; keep it distinct here too
+    _classifier(paths["politeness"], vocab_file, POLITENESS_LABELS, lowercase=False)
+    _generator(paths["generator"], vocab_file)
+    return paths
+
+
+def install(root: Optional[str] = None, seed: int = 0) -> Dict[str, str]:
+    """Build the stub checkpoints (once per process) and point analyzer / rephrase at them"""
+    global _installed
+    if _installed is None:
+        _installed = build(root or tempfile.mkdtemp(prefix="stub_models_"), seed)
+    analyzer.MODEL_TOXIC = _installed["toxic"]
+    analyzer.MODEL_EMOTION = _installed["emotion"]
+    analyzer.MODEL_EMPATHY = _installed["empathy"]
+    analyzer.MODEL_POLITENESS = _installed["politeness"]
+    rephrase.model_name = _installed["generator"]
+    return _installed
@@ -0,0 +1,287 @@
+"""
+Logging and metrics for the backend hot path.
+
+Logging
+    get_logger(name) returns a stdlib logger whose records go through a QueueHandler;
+    a background QueueListener does the actual stderr I/O, so request threads never
+    block on stdout. Every record is one JSON object; pass fields with `extra=`:
+        log.info("rephrase attempt", extra={"attempt": 2, "goals": goals})
+    Sampling is decided once per request (request_context()), so a sampled request
+    keeps all of its INFO/DEBUG lines and the others keep none (LOG_SAMPLE_RATE,
+    default 0.1). WARNING and above are always kept. User text must go through
+    redact(), which hides it unless LOG_USER_TEXT=1.
+
+Metrics
+    Counter / Gauge / Histogram with labels, rendered in the Prometheus text format by
+    render() (served at GET /metrics). span("stage", model="toxic") times a block into
+    the stage_seconds histogram.
+
+Environment:
+    LOG_LEVEL        default INFO
+    LOG_SAMPLE_RATE  fraction of requests whose INFO/DEBUG records are kept, default 0.1
+    LOG_USER_TEXT    set to 1 to log user text verbatim (local debugging only)
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+LOG_USER_TEXT = os.environ.get("LOG_USER_TEXT", "0") == "1"
+
+
+# --- logging ---
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_sampled: ContextVar[Optional[bool]] = ContextVar("log_sampled", default=None)
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None):
+    """Tag log records in the body with a request id and decide sampling once for all of them"""
+    id_token = _request_id.set(request_id or uuid.uuid4().hex[:12])
+    sampled_token = _sampled.set(random.random() < LOG_SAMPLE_RATE)
+    try:
+        yield
+    finally:
+        _sampled.reset(sampled_token)
+        _request_id.reset(id_token)
+
+
+class _SampleFilter(logging.Filter):
+    """
+    Keep every WARNING+ record. Inside a request, keep the rest if the request was sampled;
+    outside one (startup, model loading), keep a random `rate` fraction.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        if record.levelno >= logging.WARNING:
+            return True
+        sampled = _sampled.get()
+        return sampled if sampled is not None else random.random() < self.rate
+
+
+# attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "request_id"}
+
+
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, request_id and the `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_log_lock = threading.Lock()
+
+
+def _start_listener() -> None:
+    global _listener
+    with _log_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler()
+        # records arrive already rendered to JSON by the QueueHandler
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _listener = logging.handlers.QueueListener(_log_queue, handler, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger that writes through the background queue listener"""
+    _start_listener()
+    logger = logging.getLogger(name)
+    if not any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers):
+        handler = logging.handlers.QueueHandler(_log_queue)
+        handler.addFilter(_SampleFilter(LOG_SAMPLE_RATE))
+        # formatted in the caller's thread so request_id and extra fields are captured there
+        handler.setFormatter(_JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+def redact(text: Optional[str]) -> str:
+    """Placeholder for user text in logs: length and a short hash, unless LOG_USER_TEXT=1"""
+    if text is None:
+        return "<none>"
+    if LOG_USER_TEXT:
+        return text
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:8]
+    return f"<redacted len={len(text)} sha={digest}>"
+
+
+# --- metrics ---
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_fmt_labels(k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1  # +Inf
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        for key, counts, total in items:
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', repr(bound))])} {c}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {counts[-1]}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {counts[-1]}")
+        return lines
+
+
+_registry: Dict[str, _Metric] = {}
+
+
+def _register(metric: _Metric) -> _Metric:
+    return _registry.setdefault(metric.name, metric)
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared across modules
+STAGE_SECONDS = _register(Histogram("stage_seconds", "Time spent per pipeline stage (tokenize, forward, generate, ...)"))
+MODEL_LOAD_SECONDS = _register(Gauge("model_load_seconds", "Time it took to load each model"))
+REQUESTS = _register(Counter("requests_total", "Requests handled, by endpoint and outcome"))
+REQUEST_SECONDS = _register(Histogram("request_seconds", "End-to-end request latency, by endpoint"))
+QUEUE_WAIT_SECONDS = _register(Histogram("queue_wait_seconds", "Scheduler queue wait, by request class"))
+SCHEDULER_REJECTED = _register(Counter("scheduler_rejected_total", "Requests shed because their class queue was full"))
+REPHRASE_ATTEMPTS = _register(Histogram("rephrase_attempts", "Generation attempts per /rephrase request", buckets=(1, 2, 3, 4)))
+REPHRASE_FAILURES = _register(Counter("rephrase_failures_total", "Rephrase requests that exhausted all attempts"))
+GENERATED_TOKENS = _register(Counter("generated_tokens_total", "Tokens produced by the rephrasing model"))
+REPHRASE_ABORTED = _register(Counter("rephrase_aborted_candidates_total", "Candidates abandoned mid-generation by the early-abort check"))
+REPHRASE_TOKENS_SAVED = _register(Histogram("rephrase_tokens_saved", "Estimated generation tokens saved by early abort, per /rephrase request", buckets=(0, 16, 32, 64, 128, 256, 512, 1024)))
+REPHRASE_CACHE_HITS = _register(Counter("rephrase_cache_hits_total", "Rephrase responses served from the cache, by tier"))
+REPHRASE_CACHE_MISSES = _register(Counter("rephrase_cache_misses_total", "Rephrase requests that missed the cache"))
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Time the body into stage_seconds{stage=..., **labels}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, **labels)
+
+
+@contextmanager
+def timed_load(model: str):
+    """Record how long loading `model` took into model_load_seconds"""
+    start = time.perf_counter()
+    yield
+    MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=model)
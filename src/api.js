@@ -61,6 +61,11 @@ export async function analyzeText(text) {
     //     }),
     // });
 
+    return toAnalysisResult(data);
+}
+
+// Map an /analyze response into the UI shape expected by the results popup
+function toAnalysisResult(data) {
     return {
         old_toxicity: data?.old_toxicity || 'N/A',
         old_empathy: data?.old_empathy || 'N/A',
@@ -74,19 +79,23 @@ export async function analyzeText(text) {
     };
 }
 
-/**
- * Improve the user original text by focusing on selected categories
- * @param {string} original_text The current suggestion text
- * @param {string[]} selectedCategories e.g., ['toxicity','proSocial']
- */
-export async function improveSuggestion(original_text, selectedCategories = []) {
-    const payload = {
+function toRephrasePayload(original_text, selectedCategories) {
+    return {
         user_input: original_text,
         improve_toxicity: selectedCategories.includes('toxicity'),
         improve_prosocial: selectedCategories.includes('proSocial'),
         improve_politeness: selectedCategories.includes('politeness'),
         improve_empathy: selectedCategories.includes('empathy')
     };
+}
+
+/**
+ * Improve the user original text by focusing on selected categories
+ * @param {string} original_text The current suggestion text
+ * @param {string[]} selectedCategories e.g., ['toxicity','proSocial']
+ */
+export async function improveSuggestion(original_text, selectedCategories = []) {
+    const payload = toRephrasePayload(original_text, selectedCategories);
     const data = await request('/rephrase', {
         method: 'POST',
         body: JSON.stringify(payload),
@@ -94,6 +103,113 @@ export async function improveSuggestion(original_text, selectedCategories = [])
     return data;
 }
 
+/**
+ * Error used to reject a channel request that was replaced by a newer one
+ */
+export class SupersededError extends Error {
+    constructor(id) {
+        super(`Request ${id} was superseded`);
+        this.name = 'SupersededError';
+    }
+}
+
+/**
+ * Long-lived WebSocket channel to the backend, one per editor.
+ * Every message carries an increasing sequence id; sending a new analyze (or rephrase)
+ * supersedes the previous one of the same type, which the backend then drops or aborts.
+ * The socket lives in the background script (Private Network Access), we talk to it
+ * through a runtime port.
+ */
+export class EditorChannel {
+    constructor() {
+        this.port = null;
+        this.nextId = 1;
+        this.pending = new Map(); // id -> { type, resolve, reject }
+    }
+
+    connect() {
+        if (this.port) return this.port;
+        const port = chrome.runtime.connect({ name: 'socially-ws' });
+        const wsUrl = BACKEND_URL.replace(/^http/, 'ws') + '/ws';
+        port.postMessage({ type: 'ws-open', url: wsUrl });
+
+        port.onMessage.addListener((msg) => {
+            const entry = this.pending.get(msg?.id);
+            if (!entry) return; // superseded or unknown id
+            this.pending.delete(msg.id);
+            if (msg.ok) {
+                entry.resolve(msg.result);
+            } else {
+                entry.reject(new Error(`HTTP ${msg.status}: ${msg.error}`));
+            }
+        });
+        port.onDisconnect.addListener(() => {
+            this.port = null;
+            for (const entry of this.pending.values()) {
+                entry.reject(new Error('Backend connection closed'));
+            }
+            this.pending.clear();
+        });
+
+        this.port = port;
+        return port;
+    }
+
+    send(type, payload) {
+        const port = this.connect();
+        const id = this.nextId++;
+
+        // Reject older in-flight requests of the same type, the backend drops them too
+        for (const [oldId, entry] of this.pending) {
+            if (entry.type === type) {
+                this.pending.delete(oldId);
+                entry.reject(new SupersededError(oldId));
+            }
+        }
+
+        return new Promise((resolve, reject) => {
+            this.pending.set(id, { type, resolve, reject });
+            port.postMessage({ id, type, ...payload });
+        });
+    }
+
+    /**
+     * Same as analyzeText, over the channel
+     * @param {string} text - The text to analyze
+     */
+    async analyze(text) {
+        const data = await this.send('analyze', { user_input: text });
+        return toAnalysisResult(data);
+    }
+
+    /**
+     * Same as improveSuggestion, over the channel
+     * @param {string} original_text The current suggestion text
+     * @param {string[]} selectedCategories e.g., ['toxicity','proSocial']
+     */
+    improve(original_text, selectedCategories = []) {
+        return this.send('rephrase', toRephrasePayload(original_text, selectedCategories));
+    }
+
+    /**
+     * Cancel everything in flight on this channel
+     */
+    cancelAll() {
+        if (!this.port) return;
+        for (const [id, entry] of this.pending) {
+            entry.reject(new SupersededError(id));
+        }
+        this.pending.clear();
+        this.port.postMessage({ type: 'cancel' });
+    }
+
+    close() {
+        this.cancelAll();
+        if (this.port) this.port.disconnect();
+        this.port = null;
+    }
+}
+
 /**
  * Set the backend URL (useful for configuration)
  * @param {string} url - The backend URL
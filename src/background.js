@@ -144,3 +144,51 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
 
   return true; // async response
 });
+
+// WebSocket relay: one long-lived socket per editor channel.
+// Content scripts open a port named 'socially-ws' (see api.js EditorChannel); the first
+// message carries the socket URL, every later message is forwarded to the backend as-is
+// and every backend message is posted back on the port.
+chrome.runtime.onConnect.addListener((port) => {
+  if (port.name !== 'socially-ws') return;
+
+  let socket = null;
+  let pending = [];
+
+  port.onMessage.addListener((msg) => {
+    if (msg && msg.type === 'ws-open') {
+      console.log('background: opening WebSocket to', msg.url);
+      socket = new WebSocket(msg.url);
+      socket.onopen = () => {
+        pending.forEach((m) => socket.send(m));
+        pending = [];
+      };
+      socket.onmessage = (event) => {
+        try {
+          port.postMessage(JSON.parse(event.data));
+        } catch (err) {
+          console.error('background: bad WebSocket message', err);
+        }
+      };
+      socket.onclose = () => {
+        try { port.disconnect(); } catch (e) { }
+      };
+      socket.onerror = (err) => {
+        console.error('background: WebSocket error', err);
+      };
+      return;
+    }
+    if (!socket) return;
+    const data = JSON.stringify(msg);
+    if (socket.readyState === WebSocket.OPEN) {
+      socket.send(data);
+    } else {
+      pending.push(data);
+    }
+  });
+
+  port.onDisconnect.addListener(() => {
+    if (socket) socket.close();
+    socket = null;
+  });
+});
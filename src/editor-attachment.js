@@ -4,7 +4,7 @@ import { isEditable, getText, DEFAULT_DEBOUNCE_MS } from './utils.js';
 import { getPrioritySelectors } from './selectors.js';
 import { resultsPopup } from './results-popup.js';
 import { showTestPopup } from './test-popup.js';
-import { analyzeText } from './api.js';
+import { analyzeText, EditorChannel } from './api.js';
 
 // Attach to an editable element to listen for input events
 export function attachToEditable(el, options = {}) {
@@ -14,6 +14,8 @@ export function attachToEditable(el, options = {}) {
     const debounceMs = options.debounceMs || DEFAULT_DEBOUNCE_MS;
     let timer = null;
     let isComposing = false;
+    // One backend channel per editor; newer requests supersede older ones
+    const channel = new EditorChannel();
 
     // Create the "S" icon button dynamically
     const iconButton = document.createElement('button');
@@ -42,7 +44,7 @@ export function attachToEditable(el, options = {}) {
         }
 
         // Analyze first to get scores, then show improve popup with those scores
-        resultsPopup.analyzeAndShowImprovePopup(text, el);
+        resultsPopup.analyzeAndShowImprovePopup(text, el, channel);
     });
 
     // Add icon to the DOM
@@ -51,7 +53,9 @@ export function attachToEditable(el, options = {}) {
     // Store cleanup/reference
     const attached = {
         element: el,
+        channel,
         detach() {
+            channel.close();
             el.__sociallyCaptureAttached = null;
         }
     };
@@ -14,6 +14,7 @@ export class ResultsPopup {
         this.improvePopup = null; // Store reference to improve popup
         this.escHandler = null; // Store ESC handler for cleanup
         this.originalText = null; // Original user input text
+        this.channel = null; // Backend channel of the editor being analyzed
     }
 
 
@@ -221,15 +222,16 @@ export class ResultsPopup {
     /**
      * Analyze first to get initial scores, then show improve popup with those scores
      */
-    async analyzeAndShowImprovePopup(text, targetElement) {
+    async analyzeAndShowImprovePopup(text, targetElement, channel = null) {
         this.originalText = text;
         this.targetElement = targetElement;
+        this.channel = channel;
 
         this.showLoading();
 
         try {
             // Get initial analysis to have scores for the improve popup
-            const initialResults = await analyzeText(text);
+            const initialResults = channel ? await channel.analyze(text) : await analyzeText(text);
             console.log('Initial analysis results:', initialResults);
 
             // Store initial results
@@ -257,6 +259,7 @@ export class ResultsPopup {
             );
 
         } catch (error) {
+            if (error.name === 'SupersededError') return; // a newer request replaced this one
             console.error('Error analyzing text:', error);
             this.showError(`Failed to analyze text: ${error.message}`);
         }
@@ -271,7 +274,9 @@ export class ResultsPopup {
 
         try {
             // We already have the analysis results from initial analysis
-            const improved = await improveSuggestion(text, selectedCategories);
+            const improved = this.channel
+                ? await this.channel.improve(text, selectedCategories)
+                : await improveSuggestion(text, selectedCategories);
 
             // Store original text and selected categories
             try { improved.original_text = text; } catch (_) { }
@@ -281,6 +286,7 @@ export class ResultsPopup {
             this.forceClosePopup();
             this.show(improved, targetElement);
         } catch (error) {
+            if (error.name === 'SupersededError') return;
             console.error('Error improving text:', error);
             this.showError(`Failed to improve text: ${error.message || error}`);
         }